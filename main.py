@@ -1,7 +1,6 @@
 from selenium import webdriver
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.options import Options
-import requests
 from bs4 import BeautifulSoup
 
 from selenium.common.exceptions import NoSuchElementException
@@ -9,12 +8,16 @@ from selenium.common.exceptions import NoSuchElementException
 from PIL import Image
 import io
 
+import os
 import time
 
 import pandas as pd
 
 import utils.functions as F
 import utils.data as data
+import utils.search as search
+import utils.scheduler as scheduler
+import utils.output as output
 
 from absl import app
 from absl import flags
@@ -27,70 +30,143 @@ flags.DEFINE_string('target', 'suumo', 'suumo or jalan')
 flags.DEFINE_integer('page_interval', 60, 'page sleep interval time')
 flags.DEFINE_integer('img_interval', 30, 'img sleep interval time')
 flags.DEFINE_integer('img10_interval', 30, '10 imgs sleep interval time')
+flags.DEFINE_integer('batch_size', 100, 'number of jalan records written to csv at once')
+flags.DEFINE_string('archive_dir', 'archive', 'raw html archive dir (empty string disables archiving)')
+flags.DEFINE_integer('max_runtime', 0, 'max crawl time in seconds (0 means unlimited)')
+flags.DEFINE_integer('max_requests', 0, 'max number of requests (0 means unlimited)')
+flags.DEFINE_list('host_budgets', [], 'max number of requests per host (e.g. suumo.jp:500,jalan.net:300)')
+flags.DEFINE_string('checkpoint_dir', 'checkpoint', 'crawl checkpoint dir')
+flags.DEFINE_string('search_index', 'csv/jalan/reviews.db', 'jalan review search index path (empty string disables indexing)')
+
+def _is_valid_host_budgets(host_budgets:list) -> bool:
+    try:
+        scheduler.parse_host_budgets(host_budgets)
+    except ValueError:
+        return False
+    return True
+
+flags.register_validator('host_budgets', _is_valid_host_budgets, message='--host_budgets must be a list of host:count (e.g. suumo.jp:500,jalan.net:300)')
+
+def make_scheduler(target:str, prefecture_name:str) -> scheduler.Scheduler:
+    checkpoint_path = os.path.join(FLAGS.checkpoint_dir, '{target}_{filename}.json'.format(target=target, filename=prefecture_name))
+    return scheduler.Scheduler(FLAGS.max_runtime, FLAGS.max_requests, scheduler.parse_host_budgets(FLAGS.host_budgets), checkpoint_path)
 
 def suumo():
-    house_id = 0
     pref_sum_count = 0
 
     for url in [data.urls[FLAGS.pref_name]]:
         prefecture_name = FLAGS.pref_name
         pref_sum_count += 1
         url = url
-        data_list = []
         page_count = 0
+        houses_dict = {}
+        img_list = []
 
         logging.info(pref_sum_count, prefecture_name)
 
-        options = Options()
-        options.add_argument('--headless')
-        browser = webdriver.Chrome(ChromeDriverManager().install(), options=options)
-        browser.get(url)
-
-	# 次へをクリックして、ページがなくなるまで繰り返しページを探索する
-        while True:
-            url = browser.current_url
-            logging.info(url)
-            #ブラウザの起動
+        if FLAGS.archive_dir:
+            F.set_archive_dir(os.path.join(FLAGS.archive_dir, 'suumo', prefecture_name))
+
+        crawl_scheduler = make_scheduler('suumo', prefecture_name)
+        F.set_scheduler(crawl_scheduler)
+        # 前回上限で止まったときは、その一覧ページとページ番号から再開する
+        if crawl_scheduler.next_index_url is not None:
+            url = crawl_scheduler.next_index_url
+            page_count = crawl_scheduler.state.get('page_count', 0)
+        # 画像の名前が前回までのクロールやチェックポイントに残っている画像と重ならないように、物件の通し番号は続きから振る
+        house_id = crawl_scheduler.state.get('house_id', 0)
+        run_id = time.strftime('%Y%m%d%H%M%S')
+
+        browser = None
+        try:
             options = Options()
             options.add_argument('--headless')
             browser = webdriver.Chrome(ChromeDriverManager().install(), options=options)
-
+            crawl_scheduler.charge(url)
             browser.get(url)
 
-            try:
-                res = requests.get(url)
-                soup = BeautifulSoup(res.content, 'html.parser')
-                urls = F.get_urls(soup) #個別ページのURLを取得
-                house_info, house_id = F.get_index_info(urls, data_list, house_id, FLAGS.page_interval, FLAGS.img_interval, FLAGS.img10_interval)
+            # ①次へをクリックして、ページがなくなるまで一覧ページを探索し、新しい物件と内容が変わった物件を取得予定に追加する
+            while True:
+                url = browser.current_url
+                crawl_scheduler.next_index_url = url
+                logging.info(url)
+                #ブラウザの起動
+                options = Options()
+                options.add_argument('--headless')
+                browser = webdriver.Chrome(ChromeDriverManager().install(), options=options)
+
+                crawl_scheduler.charge(url)
+                browser.get(url)
+
+                soup = BeautifulSoup(F.get_html(url, 'suumo_index'), 'html.parser')
+                for listing_url, listing_fingerprint in F.get_listings(soup): #個別ページのURLを取得
+                    priority = crawl_scheduler.listing_priority(listing_url, listing_fingerprint)
+                    crawl_scheduler.push(priority, {'type':'listing', 'url':listing_url, 'fingerprint':listing_fingerprint, 'page_num':page_count})
+
+                try:
+                    browser.find_element_by_link_text('次へ').click()
+                except NoSuchElementException:
+                    browser.quit()
+                    browser = None
+                    crawl_scheduler.next_index_url = None
+                    break
 
-                browser.find_element_by_link_text('次へ').click()
                 if page_count % 10 == 0:
                     logging.info("pages:{0}".format(page_count))
                     logging.info('==============================================')
                     time.sleep(60)
                 time.sleep(60)
 
-                houses_dict = {}
-                img_list = []
-
-                for house in house_info:
-                    # Pandasで加工しやすいようにKeyが一つの辞書に家の情報を変更する
-                    house_id, house_dict = F.edit_house_data(house)
-                    houses_dict[house_id] = house_dict
-                    # Houseの画像は変更が必要ないので、そのままリストに追加する
-                    # ただ、一つづつ取り出して追加する必要があるので、要注意
-                    img_list += house['imgs']
-
-                attribute_df = pd.DataFrame(houses_dict).transpose()
-                attribute_df.to_csv('csv/suumo/attribute_{filename}_{page_num}.csv'.format(filename = prefecture_name, page_num=page_count))
-                imgs_df = pd.DataFrame(img_list)
-                imgs_df.to_csv('csv/suumo/imgs_{filename}_{page_num}.csv'.format(filename = prefecture_name, page_num=page_count))
-
                 page_count += 1
 
-            except NoSuchElementException:
+            # ②新しい物件、内容が変わった物件、画像の順に取得する
+            sleep_count = 0
+            while True:
+                next_task = crawl_scheduler.pop()
+                if next_task is None:
+                    break
+                priority, task = next_task
+
+                try:
+                    if task['type'] == 'listing':
+                        logging.info("property's page URL : ", task['url'])
+                        page_soup = F.get_page_soup(task['url'], FLAGS.page_interval)
+                        house = F.get_house_info(page_soup, house_id, 'https://suumo.jp' + task['url'])
+                        # Pandasで加工しやすいようにKeyが一つの辞書に家の情報を変更する
+                        house_id, house_dict = F.edit_house_data(house)
+                        house_dict['page_num'] = task['page_num']
+                        houses_dict[house_id] = house_dict
+                        # 画像はテキストのページをすべて取得してから取得する
+                        for house_img in F.get_house_img_urls(page_soup, house_id):
+                            crawl_scheduler.push(scheduler.PRIORITY_IMAGE, dict(house_img, type='image', url=house_img['img_url']))
+                        crawl_scheduler.mark_done(task['url'], task['fingerprint'])
+                        house_id += 1
+                    elif task['type'] == 'image':
+                        img_list.append(F.save_house_img(task))
+                        time.sleep(FLAGS.img_interval)
+                        # 10枚画像取るごとにちょっとながめに休憩
+                        if sleep_count % 10 == 0:
+                            time.sleep(FLAGS.img10_interval)
+                        sleep_count += 1
+                except scheduler.BudgetExhausted:
+                    # 途中で止まった取得予定は次回に回す
+                    crawl_scheduler.push(priority, task)
+                    raise
+
+        except scheduler.BudgetExhausted as e:
+            logging.info('budget exhausted: {0}'.format(e))
+            if browser is not None:
                 browser.quit()
-                break
+
+        finally:
+            crawl_scheduler.state['house_id'] = house_id
+            crawl_scheduler.state['page_count'] = page_count
+            crawl_scheduler.save_checkpoint()
+
+            attribute_df = pd.DataFrame(houses_dict).transpose()
+            attribute_df.to_csv('csv/suumo/attribute_{filename}_{run_id}.csv'.format(filename = prefecture_name, run_id=run_id))
+            imgs_df = pd.DataFrame(img_list)
+            imgs_df.to_csv('csv/suumo/imgs_{filename}_{run_id}.csv'.format(filename = prefecture_name, run_id=run_id))
 
         logging.info('browser quit')
 
@@ -100,115 +176,100 @@ def jalan():
     for url in [data.jalan_urls['Yamagata']]:
         prefecture_name = 'Yamagata'
         pref_sum_count += 1
-        landmark_count = 0
         url = url
-        data_list = [] #多分いらない
-        page_count = 0
 
         logging.info(pref_sum_count, prefecture_name)
 
-        options = Options()
-        options.add_argument('--headless')
-        browser = webdriver.Chrome(ChromeDriverManager().install(), options=options)
-        browser.get(url)
-
-        # 次へをクリックして、観光地自体のページがなくなるまで繰り返しページを探索する
-        while True:
-            url = browser.current_url
-            logging.info(url)
-            #ブラウザの起動
-            # ⓪任意の県だけのページを取得
+        if FLAGS.archive_dir:
+            F.set_archive_dir(os.path.join(FLAGS.archive_dir, 'jalan', prefecture_name))
+
+        search_conn = search.open_index(FLAGS.search_index) if FLAGS.search_index else None
+
+        crawl_scheduler = make_scheduler('jalan', prefecture_name)
+        F.set_scheduler(crawl_scheduler)
+        # 前回上限で止まったときは、その一覧ページと観光地の通し番号から再開して、同じCSVに追記する
+        # 新しくクロールを始めるときは、観光地の通し番号を0に戻して新しいCSVに書き込む
+        if crawl_scheduler.next_index_url is not None:
+            url = crawl_scheduler.next_index_url
+        else:
+            crawl_scheduler.state = {'landmark_count' : 0, 'run_id' : time.strftime('%Y%m%d%H%M%S')}
+        landmark_count = crawl_scheduler.state.get('landmark_count', 0)
+        run_id = crawl_scheduler.state.setdefault('run_id', time.strftime('%Y%m%d%H%M%S'))
+
+        # レビューと画像はクロールごとに1つのCSVに、batch_size件ずつまとめて追記する
+        attribute_path = 'csv/jalan/attribute_{filename}_{run_id}.csv'.format(filename = prefecture_name, run_id=run_id)
+        reviews_writer = output.BatchCsvWriter(attribute_path, F.JALAN_REVIEW_COLUMNS, FLAGS.batch_size)
+        imgs_writer = output.BatchCsvWriter('csv/jalan/imgs_{filename}_{run_id}.csv'.format(filename = prefecture_name, run_id=run_id), F.JALAN_IMG_COLUMNS, FLAGS.batch_size)
+        # 再開したときは、一覧ページの途中まで書き込んだレビューを取得し直さない
+        written_review_urls = output.load_written_values(attribute_path, "レビューURL")
+
+        browser = None
+        try:
             options = Options()
             options.add_argument('--headless')
             browser = webdriver.Chrome(ChromeDriverManager().install(), options=options)
+            crawl_scheduler.charge(url)
             browser.get(url)
 
-            try:
-                res = requests.get(url)
-                soup = BeautifulSoup(res.content, 'html.parser')
-                urls = F.get_urls(soup, target='jalan') #⓪任意の件に含まれる1ページの全観光地のリンク
-
-                for url in urls:
-                    # ①一つの観光地についての口コミ１ページ
-                    page_url = "https:" + url + 'kuchikomi'
-                    logging.info('Starting landmark page url')
-                    review_count = 0
-                    while True:
-                        options = Options()
-                        options.add_argument('--headless')
-                        browser_page = webdriver.Chrome(ChromeDriverManager().install(), options=options)
-                        browser_page.get(page_url)
-
-                        page_res = requests.get(page_url)
-
-                        page_current_url = browser_page.current_url
-                        page_soup = BeautifulSoup(page_res.content, 'html.parser')
-
-                        # ①観光地のレビュー、一覧ページ
-                        all_content = page_soup.find_all('div', attrs={'class' : 'item-listContents'})
-                        reviews_dict = {}
-                        reviews_img_dict = {}
-                        for content in all_content:
-
-                            if F.is_existing_img(content):
-                                # ②IMGのコメントだけを抽出
-                                review_page_soup = F.get_review_page_soup(content)
-                                review_property_dict = F.get_jalan_review(review_count, content, review_page_soup)
-
-                                if review_property_dict['review'] == '' and 'Error' in review_property_dict:
-                                    logging.warning('review encoding error:', review_property_dict['Error']) 
-                                    break
-                                elif review_property_dict['review'] == '':
-                                    logging.warning('review encoding error:', review_property_dict['Error']) 
-                                    break
-
-                                img_name_list = F.get_review_img(landmark_count, review_count, review_page_soup, FLAGS.img_interval)
-
-                                review_count += 1
-                            page_count += 1
-
-                        try:
-                            browser_page.find_element_by_link_text('次へ').click()
-                            time.sleep(FLAGS.page_interval)
-                            page_url = browser_page.current_url
-                        except NoSuchElementException:
-                            browser.quit()
-                            break
-
-                   try:
-                       reviews_dict[review_count] = {
-                                            "レビューID" : review_property_dict['review_id'],
-                                            "レビューURL" : review_property_dict['review_page_url'],
-                                            "タイトル" : review_property_dict['title'],
-                                            "レビュー" : review_property_dict['review'],
-                                            "行った時期" : review_property_dict['行った時期'],
-                                            "混雑具合" : review_property_dict['混雑具合'],
-                                            "滞在時間" : review_property_dict['滞在時間'],
-                                            "投稿日" : review_property_dict['投稿日'],
-                                            }
-                    except:
-                        reviews_dict[review_count] = {
-                                            "レビューID" : review_property_dict['review_id'],
-                                            "レビューURL" : review_property_dict['review_page_url'],
-                                            "タイトル" : review_property_dict['title'],
-                                            "レビュー" : review_property_dict['review'],
-                                            "混雑具合" : review_property_dict['混雑具合'],
-                                            "滞在時間" : review_property_dict['滞在時間'],
-                                            "投稿日" : review_property_dict['投稿日'],
-                                            }
-
-                    reviews_img_dict[review_count] = {"imgs" : img_name_list}
-
-                    attribute_df = pd.DataFrame(reviews_dict).transpose()
-                    attribute_df.to_csv('csv/jalan/attribute_{filename}_{landmark_count}.csv'.format(filename = prefecture_name, landmark_count=landmark_count))
-                    imgs_df = pd.DataFrame(reviews_img_dict)
-                    imgs_df.to_csv('csv/jalan/imgs_{filename}_{landmark_count}.csv'.format(filename = prefecture_name, landmark_count=landmark_count))
-
-                    landmark_count += 1
-
-            except NoSuchElementException:
+            # 次へをクリックして、観光地自体のページがなくなるまで繰り返しページを探索する
+            while True:
+                url = browser.current_url
+                crawl_scheduler.next_index_url = url
+                crawl_scheduler.state['landmark_count'] = landmark_count
+                logging.info(url)
+                #ブラウザの起動
+                # ⓪任意の県だけのページを取得
+                options = Options()
+                options.add_argument('--headless')
+                browser = webdriver.Chrome(ChromeDriverManager().install(), options=options)
+                crawl_scheduler.charge(url)
+                browser.get(url)
+
+                try:
+                    soup = BeautifulSoup(F.get_html(url, 'jalan_index'), 'html.parser')
+                    urls = F.get_urls(soup, target='jalan') #⓪任意の件に含まれる1ページの全観光地のリンク
+
+                    for url in urls:
+                        landmark_url = "https:" + url
+                        logging.info('Starting landmark page url')
+
+                        # ①②観光地の口コミページをたどって、画像付きのレビューを1件ずつ受け取る
+                        for review_property_dict, img_name_list in F.iter_landmark_reviews(landmark_count, landmark_url, FLAGS.page_interval, FLAGS.img_interval, written_review_urls):
+                            reviews_writer.write(F.to_jalan_review_record(landmark_count, landmark_url, review_property_dict))
+                            for img_name in img_name_list:
+                                imgs_writer.write({"観光地ID" : landmark_count, "レビューID" : review_property_dict['review_id'], "画像名" : img_name})
+
+                            if search_conn is not None:
+                                search.add_review(search_conn, landmark_count, landmark_url, review_property_dict)
+
+                        if search_conn is not None:
+                            search_conn.commit()
+
+                        landmark_count += 1
+
+                    browser.find_element_by_link_text('次へ').click()
+                    time.sleep(FLAGS.page_interval)
+
+                except NoSuchElementException:
+                    browser.quit()
+                    browser = None
+                    crawl_scheduler.next_index_url = None
+                    crawl_scheduler.state['landmark_count'] = landmark_count
+                    break
+
+        except scheduler.BudgetExhausted as e:
+            logging.info('budget exhausted: {0}'.format(e))
+            if browser is not None:
                 browser.quit()
-                break
+
+        finally:
+            reviews_writer.close()
+            imgs_writer.close()
+            # 再開したときはCSVに書き込み済みのレビューを飛ばすので、検索インデックスも同じタイミングでコミットしておく
+            if search_conn is not None:
+                search_conn.commit()
+                search_conn.close()
+            crawl_scheduler.save_checkpoint()
 
         logging.info('browser quit')
 
@@ -0,0 +1,151 @@
+from bs4 import BeautifulSoup
+
+from typing import Union
+import multiprocessing
+import os
+
+import pandas as pd
+
+import utils.functions as F
+import utils.archive as archive
+
+from absl import app
+from absl import flags
+from absl import logging
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('pref_name', 'Yamagata', 'pref name')
+flags.DEFINE_string('target', 'suumo', 'suumo or jalan')
+flags.DEFINE_string('archive_dir', 'archive', 'raw html archive dir')
+flags.DEFINE_string('output_dir', 'csv/reextract', 're-extracted csv dir')
+flags.DEFINE_integer('processes', None, 'number of worker processes (default: all cores)')
+
+def extract_suumo_page(record_id:int, url:str, soup:BeautifulSoup) -> dict:
+    house_dict = F.get_title_and_comment(soup)
+    house_dict['url'] = url
+    return house_dict
+
+def extract_suumo_details(record_id:int, url:str, soup:BeautifulSoup) -> dict:
+    try:
+        house_dict = F.extract_table_data(F.get_house_details_table(soup))
+    except Exception as e:
+        logging.error('extract_table_data Error: %s %s', url, e)
+        house_dict = {}
+    house_dict['url'] = url
+    return house_dict
+
+def extract_jalan_review(record_id:int, url:str, soup:BeautifulSoup) -> dict:
+    return F.extract_jalan_review(record_id, url, soup)
+
+def to_landmark_url(page_url:Union[None, str]) -> Union[None, str]:
+    """to_landmark_url
+
+        口コミページのURLから観光地のページのURLを取り出す関数
+
+        Args:
+            page_url (str): 口コミページのURL（例：'https://www.jalan.net/kankou/spt_06201ag2130012345/kuchikomi/page_2/'）
+
+        Returns:
+            str: 観光地のページのURL（例：'https://www.jalan.net/kankou/spt_06201ag2130012345/'）。口コミページのURLでないときはNone
+    """
+    if not page_url or 'kuchikomi' not in page_url:
+        return None
+
+    return page_url[:page_url.index('kuchikomi')]
+
+# アーカイブのkindごとに使う抽出関数。ここにないkind（indexページなど）は飛ばす
+extractors = {
+    'suumo_page' : extract_suumo_page,
+    'suumo_details' : extract_suumo_details,
+    'jalan_review' : extract_jalan_review,
+}
+
+def extract_entry(args:tuple) -> tuple:
+    """extract_entry
+
+        アーカイブの1レコードを読み出して抽出関数にかける関数
+        プロセスプールのワーカーで実行されるので、引数はpickleできるタプルにしている
+
+        Args:
+            args (tuple): (archive_dir, record_id, entry)。entryはindex.jsonlの1行
+
+        Returns:
+            tuple: (kind, 抽出結果の辞書)。抽出に失敗したときは(kind, None)
+    """
+    archive_dir, record_id, entry = args
+    # 1ページの抽出の失敗で全体が止まらないように、失敗したページはログに残して飛ばす
+    try:
+        soup = BeautifulSoup(archive.read_html(archive_dir, entry), 'html.parser')
+        record = extractors[entry['kind']](record_id, entry['url'], soup)
+    except Exception as e:
+        logging.error('extract Error: %s %s', entry['url'], e)
+        return entry['kind'], None
+
+    record['fetched_at'] = entry['fetched_at']
+    # 物件詳細ページは、物件ページのURL（parent_url）で物件ページの抽出結果と結びつける
+    record['parent_url'] = entry.get('parent_url')
+    # レビューは、口コミページのURL（parent_url）から観光地のURLを取り出す
+    if entry['kind'] == 'jalan_review':
+        record['観光地URL'] = to_landmark_url(entry.get('parent_url'))
+
+    return entry['kind'], record
+
+def latest_entries(entries:list) -> list:
+    """latest_entries
+
+        同じURLを何度も取得したアーカイブから、URLごとに最新（fetched_atが最後）のレコードだけを残す関数
+        古いページも抽出すると、物件ページと物件詳細ページの結合でレコードが重複するため
+
+        Args:
+            entries (list): load_indexの返り値
+
+        Returns:
+            list: URLごとに1件にしたレコードのリスト（最初に取得した順）
+    """
+    latest = {}
+    for entry in entries:
+        # index.jsonlは追記順なので、同じ時刻なら後のレコードを残す
+        if entry['url'] not in latest or entry['fetched_at'] >= latest[entry['url']]['fetched_at']:
+            latest[entry['url']] = entry
+
+    return list(latest.values())
+
+def main(argv):
+    archive_dir = os.path.join(FLAGS.archive_dir, FLAGS.target, FLAGS.pref_name)
+    entries = archive.load_index(archive_dir)
+    # エラーページ（ステータスコードが200以外）は正しいページとして抽出しない
+    valid_entries = latest_entries([entry for entry in entries if entry['kind'] in extractors and entry.get('status_code', 200) == 200])
+    tasks = [(archive_dir, record_id, entry) for record_id, entry in enumerate(valid_entries)]
+    logging.info('re-extracting %d of %d records in %s', len(tasks), len(entries), archive_dir)
+
+    # ネットワークにもsleepにも依存しないので、全コアで並列に抽出する
+    records = {kind : [] for kind in extractors}
+    error_count = 0
+    with multiprocessing.Pool(FLAGS.processes) as pool:
+        for kind, record in pool.imap(extract_entry, tasks, chunksize=64):
+            if record is None:
+                error_count += 1
+                continue
+            records[kind].append(record)
+    if error_count:
+        logging.warning('%d records could not be extracted', error_count)
+
+    os.makedirs(FLAGS.output_dir, exist_ok=True)
+    for kind, kind_records in records.items():
+        if not kind_records:
+            continue
+        output_path = os.path.join(FLAGS.output_dir, '{kind}_{filename}.csv'.format(kind=kind, filename=FLAGS.pref_name))
+        pd.DataFrame(kind_records).to_csv(output_path)
+        logging.info('wrote %d records to %s', len(kind_records), output_path)
+
+    # SUUMOは物件ページ（タイトルとコメント）と物件詳細ページ（物件情報）を結合して、物件ごとの属性情報にする
+    if records['suumo_page'] and records['suumo_details']:
+        pages_df = pd.DataFrame(records['suumo_page']).drop(columns=['parent_url'])
+        details_df = pd.DataFrame(records['suumo_details']).drop(columns=['url']).rename(columns={'parent_url':'url'})
+        attribute_df = pages_df.merge(details_df, on='url', how='left', suffixes=('', '_details'))
+        output_path = os.path.join(FLAGS.output_dir, 'attribute_{filename}.csv'.format(filename=FLAGS.pref_name))
+        attribute_df.to_csv(output_path)
+        logging.info('wrote %d houses to %s', len(attribute_df), output_path)
+
+if __name__ == '__main__':
+    app.run(main)
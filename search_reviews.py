@@ -0,0 +1,28 @@
+import utils.search as search
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('search_index', 'csv/jalan/reviews.db', 'jalan review search index path')
+flags.DEFINE_string('query', '', 'space separated search terms')
+flags.DEFINE_integer('landmark_id', None, 'landmark id (numbered per crawl, not stable across crawls)')
+flags.DEFINE_string('landmark_url', None, 'landmark page url')
+flags.DEFINE_string('since', None, 'posted date from (YYYY-MM-DD)')
+flags.DEFINE_string('until', None, 'posted date to (YYYY-MM-DD)')
+flags.DEFINE_string('crowding', None, 'crowding (e.g. 混雑していた)')
+flags.DEFINE_integer('limit', 20, 'max number of results')
+
+def main(argv):
+    conn = search.open_index(FLAGS.search_index)
+    reviews = search.search(conn, FLAGS.query, landmark_id=FLAGS.landmark_id, landmark_url=FLAGS.landmark_url, since=FLAGS.since, until=FLAGS.until, crowding=FLAGS.crowding, limit=FLAGS.limit)
+
+    for review in reviews:
+        print('[{landmark_id}] {posted} {crowding} {review_url}'.format(**review))
+        print('  {title}'.format(**review))
+        print('  {review}'.format(**review))
+
+    conn.close()
+
+if __name__ == '__main__':
+    app.run(main)
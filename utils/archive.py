@@ -0,0 +1,123 @@
+from typing import Union
+import datetime
+import gzip
+import json
+import os
+
+from absl import logging
+
+# 1セグメントの上限サイズ。これを超えたら次のセグメントに書き込む
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+INDEX_FILE_NAME = 'index.jsonl'
+
+def _segment_name(segment_id:int) -> str:
+    return 'segment_{0:05d}.gz'.format(segment_id)
+
+def _current_segment(archive_dir:str) -> str:
+    """_current_segment
+
+        書き込み先のセグメントのファイル名を返す関数
+        最後のセグメントがSEGMENT_MAX_BYTESを超えていたら新しいセグメント名を返す
+
+        Args:
+            archive_dir (str): アーカイブのディレクトリ
+
+        Returns:
+            str: セグメントのファイル名（例：'segment_00000.gz'）
+    """
+    segments = sorted(name for name in os.listdir(archive_dir) if name.startswith('segment_'))
+    if not segments:
+        return _segment_name(0)
+
+    last_segment = segments[-1]
+    if os.path.getsize(os.path.join(archive_dir, last_segment)) >= SEGMENT_MAX_BYTES:
+        return _segment_name(len(segments))
+
+    return last_segment
+
+def append_html(archive_dir:str, url:str, content:bytes, kind:str, status_code:int=200, parent_url:Union[None, str]=None) -> dict:
+    """append_html
+
+        取得したHTMLをURL、取得時刻と一緒にアーカイブに追記する関数
+
+        1. ヘッダ（URL、取得時刻、種類、ステータスコード）とHTML本体をgzipの1メンバーとしてセグメントの末尾に追記する
+        2. セグメント内のオフセットと長さをindex.jsonlに追記する
+
+        セグメントはgzipメンバーを連結しただけのファイルなので、そのままzcatでも読める
+
+        Args:
+            archive_dir (str): アーカイブのディレクトリ
+            url (str): 取得したページのURL
+            content (bytes): requests.getで取得したHTMLの中身
+            kind (str): ページの種類（例：'suumo_page', 'jalan_review'）。再抽出の際にどの関数を使うかの判定に使う
+            status_code (int): HTTPのステータスコード。再抽出の際にエラーページを飛ばすために使う
+            parent_url (str): このページへのリンクがあったページのURL（例：物件詳細ページの場合は物件ページのURL）
+
+        Returns:
+            dict: index.jsonlに書き込んだ1行分の辞書
+
+        Examples:
+
+            >>> append_html('archive/suumo/Yamagata', url, res.content, 'suumo_page', res.status_code)
+                {'url': url, 'fetched_at': '2022-06-01T12:00:00', 'kind': 'suumo_page', 'status_code': 200, 'parent_url': None, 'segment': 'segment_00000.gz', 'offset': 0, 'length': 10240}
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+
+    fetched_at = datetime.datetime.now().isoformat(timespec='seconds')
+    segment = _current_segment(archive_dir)
+
+    header = 'URL: {0}\nFetch-Time: {1}\nKind: {2}\nStatus: {3}\nContent-Length: {4}\n\n'.format(url, fetched_at, kind, status_code, len(content))
+    member = gzip.compress(header.encode('utf-8') + content)
+
+    with open(os.path.join(archive_dir, segment), 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(member)
+
+    entry = {'url':url, 'fetched_at':fetched_at, 'kind':kind, 'status_code':status_code, 'parent_url':parent_url, 'segment':segment, 'offset':offset, 'length':len(member)}
+    with open(os.path.join(archive_dir, INDEX_FILE_NAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    return entry
+
+def read_html(archive_dir:str, entry:dict) -> bytes:
+    """read_html
+
+        index.jsonlの1行分の辞書からHTMLの中身を読み出す関数
+
+        Args:
+            archive_dir (str): アーカイブのディレクトリ
+            entry (dict): append_htmlの返り値（index.jsonlの1行）
+
+        Returns:
+            bytes: 取得時のHTMLの中身（ヘッダは除く）
+    """
+    with open(os.path.join(archive_dir, entry['segment']), 'rb') as f:
+        f.seek(entry['offset'])
+        member = f.read(entry['length'])
+
+    _, content = gzip.decompress(member).split(b'\n\n', 1)
+
+    return content
+
+def load_index(archive_dir:str) -> list:
+    """load_index
+
+        index.jsonlを読み込んで辞書のリストにする関数
+        途中で止まって最後の行が壊れている場合はその行を飛ばす
+
+        Args:
+            archive_dir (str): アーカイブのディレクトリ
+
+        Returns:
+            list: append_htmlの返り値と同じ形式の辞書のリスト
+    """
+    entries = []
+    with open(os.path.join(archive_dir, INDEX_FILE_NAME), encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning('broken index line: %s', line)
+
+    return entries
@@ -18,6 +18,89 @@ import time
 
 from absl import logging
 
+import utils.archive as archive
+import utils.scheduler as scheduler
+
+# Noneでなければ、get_htmlで取得したHTMLをすべてこのディレクトリにアーカイブする
+_archive_dir = None
+# Noneでなければ、get_htmlとget_imgのリクエストをこのスケジューラの上限に数える
+_scheduler = None
+
+def set_archive_dir(archive_dir:Union[None, str]) -> None:
+    """set_archive_dir
+
+        get_htmlで取得したHTMLの保存先のアーカイブを設定する関数
+        Noneを渡すとアーカイブしない
+
+        Args:
+            archive_dir (str): アーカイブのディレクトリ（例：'archive/suumo/Yamagata'）
+    """
+    global _archive_dir
+    _archive_dir = archive_dir
+
+def set_scheduler(crawl_scheduler:Union[None, scheduler.Scheduler]) -> None:
+    """set_scheduler
+
+        get_htmlとget_imgで送るリクエストを数えるスケジューラを設定する関数
+        Noneを渡すと上限なしでリクエストを送る
+
+        Args:
+            crawl_scheduler (scheduler.Scheduler): リクエスト数と実行時間の上限を管理するスケジューラ
+    """
+    global _scheduler
+    _scheduler = crawl_scheduler
+
+def get_html(url:str, kind:str, parent_url:Union[None, str]=None) -> bytes:
+    """get_html
+
+        URLにrequestを送ってHTMLを取得する関数
+        アーカイブが設定されているときは、取得したHTMLをアーカイブにも書き込む
+
+        Args:
+            url (str): 取得するページのURL
+            kind (str): ページの種類（例：'suumo_page', 'jalan_review'）。再抽出の際にどの関数を使うかの判定に使う
+            parent_url (str): このページへのリンクがあったページのURL。アーカイブに一緒に記録する
+
+        Returns:
+            bytes: 取得したHTMLの中身
+
+        Raises:
+            scheduler.BudgetExhausted: スケジューラの上限に達しているとき
+
+        Examples:
+
+            >>> soup = BeautifulSoup(get_html(url, 'suumo_index'), 'html.parser')
+    """
+    if _scheduler is not None:
+        _scheduler.charge(url)
+
+    res = requests.get(url)
+
+    if _archive_dir is not None:
+        archive.append_html(_archive_dir, url, res.content, kind, res.status_code, parent_url)
+
+    return res.content
+
+def get_img(img_url:str) -> Image.Image:
+    """get_img
+
+        画像のURLにrequestを送って画像を取得する関数
+        画像はアーカイブしないが、スケジューラの上限には数える
+
+        Args:
+            img_url (str): 画像のURL
+
+        Returns:
+            Image.Image: 取得した画像
+
+        Raises:
+            scheduler.BudgetExhausted: スケジューラの上限に達しているとき
+    """
+    if _scheduler is not None:
+        _scheduler.charge(img_url)
+
+    return Image.open(io.BytesIO(requests.get(img_url).content))
+
 def get_urls(soup:bs4.BeautifulSoup, target:str='suumo') -> list:
     """
         get_urls
@@ -68,6 +151,30 @@ def get_urls(soup:bs4.BeautifulSoup, target:str='suumo') -> list:
 
     return urls
 
+def get_listings(soup:bs4.BeautifulSoup) -> list:
+    """get_listings
+
+        SUUMOの物件一覧のページから、各物件の内部リンクのURLと一覧ページに表示されている内容のハッシュを取得する関数
+        ハッシュは前回のクロールから物件の内容（価格など）が変わったかを判定するために使う
+
+        Args:
+            soup (bs4.BeautifulSoup): SUUMOの物件一覧ページのbs4.BeautifulSoupオブジェクト
+
+        Returns:
+            list: (URL, ハッシュ)のタプルのリスト（例：[('/chukoikkodate/yamagata/sc_tendo/nc_97027597/', '9e107d9d372bb6826bd81d3542a419d6'), ...]）
+    """
+    listings = []
+
+    for h2_elem in soup.find_all('h2', attrs={'class' : 'property_unit-title'}):
+        url = h2_elem.find('a').attrs['href']
+        unit_elem = h2_elem.find_parent('div', attrs={'class' : 'property_unit'})
+        if unit_elem is None:
+            unit_elem = h2_elem
+
+        listings.append((url, scheduler.fingerprint(unit_elem.text)))
+
+    return listings
+
 def get_page_soup(internal_url:str, page_interval:int, target:str='suumo') -> bs4.BeautifulSoup:
     """get_page_soup
 
@@ -92,14 +199,13 @@ def get_page_soup(internal_url:str, page_interval:int, target:str='suumo') -> bs
     elif target == 'jalan':
         page_url = "https:" + internal_url + 'kuchikomi'
 
-    page_res = requests.get(page_url)
-    page_soup = BeautifulSoup(page_res.content, 'html.parser')
+    page_soup = BeautifulSoup(get_html(page_url, target + '_page'), 'html.parser')
 
     time.sleep(page_interval)
 
     return page_soup
 
-def get_house_details(page_soup:bs4.BeautifulSoup) -> bs4.element.Tag:
+def get_house_details(page_soup:bs4.BeautifulSoup, page_url:Union[None, str]=None) -> bs4.element.Tag:
     """get_house_details
 
         各ページの物件情報を収集する関数
@@ -108,6 +214,7 @@ def get_house_details(page_soup:bs4.BeautifulSoup) -> bs4.element.Tag:
 
         Args:
             page_soup (bs4.BeautifulSoup): 入力は各ページのsoup
+            page_url (str): 物件ページのURL。再抽出の際に物件ページと物件詳細ページを結びつけるためにアーカイブに記録する
 
         Returns:
             bs4.element.Tag: Tableが抽出されたbs4.element.Tagオブジェクト
@@ -129,12 +236,13 @@ def get_house_details(page_soup:bs4.BeautifulSoup) -> bs4.element.Tag:
         house_details_url = house_details_a_elem.attrs['href']
 
         #物件詳細のページへのアクセス
-        house_details_res = requests.get(house_details_url)
-        house_details_soup = BeautifulSoup(house_details_res.content, 'html.parser')
+        house_details_soup = BeautifulSoup(get_html(house_details_url, 'suumo_details', page_url), 'html.parser')
 
         # テーブルの取得
-        house_details_info = house_details_soup.find('table', {'class': 'pCell10'})
+        house_details_info = get_house_details_table(house_details_soup)
 
+    except scheduler.BudgetExhausted:
+        raise
     except Exception as e:
         logging.error(e)
         logging.error("house_details_a_elem", house_details_a_elem)
@@ -143,6 +251,20 @@ def get_house_details(page_soup:bs4.BeautifulSoup) -> bs4.element.Tag:
 
     return house_details_info
 
+def get_house_details_table(house_details_soup:bs4.BeautifulSoup) -> bs4.element.Tag:
+    """get_house_details_table
+
+        物件詳細ページのbs4.BeautifulSoupオブジェクトから「物件情報」のテーブルを取り出す関数
+        アーカイブからの再抽出でも同じ処理を使うためにget_house_detailsから分けている
+
+        Args:
+            house_details_soup (bs4.BeautifulSoup): 物件詳細ページのbs4.BeautifulSoupオブジェクト
+
+        Returns:
+            bs4.element.Tag: Tableが抽出されたbs4.element.Tagオブジェクト
+    """
+    return house_details_soup.find('table', {'class': 'pCell10'})
+
 def extract_table_data(table:bs4.element.Tag) -> dict:
     """extract_table_data
 
@@ -230,14 +352,35 @@ def get_house_img(page_soup:bs4.BeautifulSoup, house_id:int, img_interval:int, i
             >>> get_house_img(page_soup, house_id)
                 [{'house_id':house_id, 'img_id':img_id, 'img_tag':img_tag, 'img_name':img_name）}...]
     """
+    img_list = list()
+
+    # 10枚画像取るごとにちょっとながめに休憩
+    for sleep_count, house_img in enumerate(get_house_img_urls(page_soup, house_id)):
+        img_list.append(save_house_img(house_img))
+        time.sleep(img_interval)
+        if sleep_count % 10 == 0:
+            time.sleep(img10_interval)
+
+    return img_list
+
+def get_house_img_urls(page_soup:bs4.BeautifulSoup, house_id:int) -> list:
+    """get_house_img_urls
+        各ページの写真のURLと名前を取得する関数。画像自体は取得しない
+        スケジューラで画像の取得を後回しにするために、get_house_imgから分けている
+
+        Args:
+            page_soup (bs4.BeautifulSoup): 入力は各ページのbs4.BeautifulSoupオブジェクトを想定
+            house_id（int）：その家の通し番号
+
+        Returns:
+            list: 画像の情報の辞書のリスト（例：[{'house_id':house_id, 'img_id':img_id, 'img_tag':img_tag, 'img_name':img_name, 'img_url':img_url}...]
+    """
     imgs = page_soup.find_all('img')
     img_list = list()
     img_id = 0
     # 以下で始まるのはIMGタグだがアクセスできないため排除する
     un_img_signal = 'gvavadfbasdfbarvbaebabaertbertbaebfbadbavafdvkavnakfvbaklvbaiklvuhiaerbnvnvkajbvkajbfgkjasbvkabvabfoak;dnvlasndvkahgvklashdvb'
 
-    # 5の倍数のときに多めに休むようにしてみる
-    sleep_count = 0
     for img in imgs:
         try:
             img_url = img['rel']
@@ -252,21 +395,29 @@ def get_house_img(page_soup:bs4.BeautifulSoup, house_id:int, img_interval:int, i
             img_url = img_url.replace('&amp;', '&') # 文字化け対策
             # 以下は画像の保存に関する記述
             if not re.compile("resizeImage").search(img_url): #無条件で持ってくるとリサイズされた画像まで持ってきてしまうためそれを防ぐ
-                logging.info("success", img_name, img_url) # 停止した場合どこで停止しているかを確認するため
-                # 画像がリサイズされていないときは保存する
-                img = Image.open(io.BytesIO(requests.get(img_url).content))
-                img.save(f'imgs/suumo/{img_name}.jpg')
-                img_list.append({'house_id':house_id, 'img_id':img_id, 'img_tag':img_tag, 'img_name':img_name})
-                time.sleep(img_interval)
-                # 10枚画像取るごとにちょっとながめに休憩
-                if sleep_count % 10 == 0:
-                    time.sleep(img10_interval)
-                sleep_count += 1
+                img_list.append({'house_id':house_id, 'img_id':img_id, 'img_tag':img_tag, 'img_name':img_name, 'img_url':img_url})
             else:
                 logging.error("false")
 
     return img_list
 
+def save_house_img(house_img:dict) -> dict:
+    """save_house_img
+        get_house_img_urlsで取得した画像を1枚取得して、imgs/suumo/に保存する関数
+
+        Args:
+            house_img (dict): get_house_img_urlsの返り値のリストの要素
+
+        Returns:
+            dict: 保存した画像の情報の辞書（例：{'house_id':house_id, 'img_id':img_id, 'img_tag':img_tag, 'img_name':img_name}）
+    """
+    logging.info("success", house_img['img_name'], house_img['img_url']) # 停止した場合どこで停止しているかを確認するため
+    # 画像がリサイズされていないときは保存する
+    img = get_img(house_img['img_url'])
+    img.save(f"imgs/suumo/{house_img['img_name']}.jpg")
+
+    return {'house_id':house_img['house_id'], 'img_id':house_img['img_id'], 'img_tag':house_img['img_tag'], 'img_name':house_img['img_name']}
+
 def get_index_info(urls:list, house_info:list, house_id:int, page_interval:int, img_interval:int, img10_interval:int) -> Union[list, int]:
     """get_index_info
         Index1ページ分のURL
@@ -288,12 +439,32 @@ def get_index_info(urls:list, house_info:list, house_id:int, page_interval:int,
     for url in urls:
         logging.info("property's page URL : ", url)
         page_soup = get_page_soup(url, page_interval)# requestをget_page_soupは送って個々の物件の情報を取得している
-        table = get_house_details(page_soup) # request送って物件詳細のテーブル情報を取得している
-        try:
-            house_info_dict = extract_table_data(table)
-        except:
-            logging.error("get_index_info Error")
-            house_info_dict = {'販売スケジュール': "",
+        house_dict = get_house_info(page_soup, house_id, 'https://suumo.jp' + url)
+        house_dict['imgs'] = get_house_img(page_soup, house_id, img_interval, img10_interval) # request送って写真を取得している
+        house_info.append(house_dict)
+
+        house_id += 1
+
+    return house_info, house_id
+
+def get_house_info(page_soup:bs4.BeautifulSoup, house_id:int, page_url:Union[None, str]=None) -> dict:
+    """get_house_info
+        物件ページ1つ分の物件情報とタイトル、コメントを取得する関数。画像は取得しない
+
+        Args:
+            page_soup (bs4.BeautifulSoup): 入力は各ページのbs4.BeautifulSoupオブジェクトを想定
+            house_id（int）：その家の通し番号
+            page_url (str): 物件ページのURL（get_house_detailsに渡す）
+
+        Returns:
+            dict: SUUMOの物件の情報が含まれている辞書（例：{'House_ID': house_id, 'text':house_text_dict, 'info':house_info_dict}）
+    """
+    table = get_house_details(page_soup, page_url) # request送って物件詳細のテーブル情報を取得している
+    try:
+        house_info_dict = extract_table_data(table)
+    except:
+        logging.error("get_house_info Error")
+        house_info_dict = {'販売スケジュール': "",
         'イベント情報': "",
         '所在地' : "",
         '交通' : "",
@@ -317,15 +488,9 @@ def get_index_info(urls:list, house_info:list, house_id:int, page_interval:int,
         '地目' : "",
         'その他制限事項' : "",
         'その他概要・特記事項' : ""}
-        house_text_dict = get_title_and_comment(page_soup)
-        house_img_list = get_house_img(page_soup, house_id, img_interval, img10_interval) # request送って写真を取得している
+    house_text_dict = get_title_and_comment(page_soup)
 
-        house_dict = {'House_ID': house_id, 'text':house_text_dict, 'info':house_info_dict, 'imgs':house_img_list}
-        house_info.append(house_dict)
-
-        house_id += 1
-
-    return house_info, house_id
+    return {'House_ID': house_id, 'text':house_text_dict, 'info':house_info_dict}
 
 def edit_house_data(house:dict) -> Union[int, dict]:
     """edit_house_data
@@ -379,35 +544,66 @@ def edit_house_data(house:dict) -> Union[int, dict]:
 
 
 # jalan only function
+# jalanのレビューのCSVのカラム。Valueはget_jalan_reviewの返り値のKey（Noneは観光地の情報）
+# 「行った時期」などがないレビューもあるので、ないカラムは空欄にする
+JALAN_REVIEW_COLUMNS = {
+    "観光地ID" : None,
+    "観光地URL" : None,
+    "レビューID" : 'review_id',
+    "レビューURL" : 'review_page_url',
+    "タイトル" : 'title',
+    "レビュー" : 'review',
+    "行った時期" : '行った時期',
+    "混雑具合" : '混雑具合',
+    "滞在時間" : '滞在時間',
+    "投稿日" : '投稿日',
+}
+JALAN_IMG_COLUMNS = ["観光地ID", "レビューID", "画像名"]
+
 def is_existing_img(content_soup:bs4.BeautifulSoup) -> Union[None, bs4.element.Tag]:
     img_existing = content_soup.find('picture', attrs={'class' : 'item-mainImg'})
     return img_existing
 
-def get_review_page_soup(content_soup:bs4.BeautifulSoup):
+def get_review_page_url(content_soup:bs4.BeautifulSoup) -> str:
     div_elem = content_soup.find('p', attrs={'class' : 'item-title'})
     # details page url
     a_elem = div_elem.find('a')
-    review_page_url = 'https:' + a_elem.attrs['href']
+    return 'https:' + a_elem.attrs['href']
+
+def get_review_page_soup(content_soup:bs4.BeautifulSoup, page_url:Union[None, str]=None):
+    review_page_url = get_review_page_url(content_soup)
     # ここはクラスにしてselfに入れる
     # review_property_dict['review_page_url'] = review_page_url
-    review_page_res = requests.get(review_page_url) #details page soup
-    review_page_soup = BeautifulSoup(review_page_res.content, 'html.parser')
+    # 再抽出の際にレビューと観光地を結びつけるため、口コミページのURLをparent_urlとしてアーカイブに記録する
+    review_page_soup = BeautifulSoup(get_html(review_page_url, 'jalan_review', page_url), 'html.parser') #details page soup
 
     return review_page_soup
 
 def get_jalan_review(review_id:int, content_soup:bs4.BeautifulSoup, review_page_soup:bs4.BeautifulSoup) -> dict:
+    return extract_jalan_review(review_id, get_review_page_url(content_soup), review_page_soup)
+
+def extract_jalan_review(review_id:int, review_page_url:str, review_page_soup:bs4.BeautifulSoup) -> dict:
+    """extract_jalan_review
+
+        レビューの詳細ページからタイトル、レビュー本文、行った時期などの属性を取り出す関数
+        一覧ページの要素を使わないので、アーカイブからの再抽出でもそのまま使える
+
+        Args:
+            review_id (int): レビューの通し番号
+            review_page_url (str): レビューの詳細ページのURL
+            review_page_soup (bs4.BeautifulSoup): レビューの詳細ページのbs4.BeautifulSoupオブジェクト
+
+        Returns:
+            dict: レビューの情報が保存された辞書（例：{'review_id':0, 'review_page_url':'', 'title':'', 'review':'', '行った時期':'', ...}）
+    """
     review_property_dict = {}
     review_property_dict['review_id'] = review_id
-
-    div_elem = content_soup.find('p', attrs={'class' : 'item-title'})
-    a_elem = div_elem.find('a')
-    review_page_url = 'https:' + a_elem.attrs['href']
     review_property_dict['review_page_url'] = review_page_url
 
     review_soup = review_page_soup.find('p', attrs={'class' : 'reviewText'})
 
     title = review_page_soup.find('h1', attrs={'class' : 'basicTitle'})
-    review_property_dict['title'] = title
+    review_property_dict['title'] = title.text.strip() if title is not None else ''
 
     # reviewの文字化けで止まってしまうことがあるのでその対策
     try:
@@ -422,22 +618,25 @@ def get_jalan_review(review_id:int, content_soup:bs4.BeautifulSoup, review_page_
         return review_property_dict
 
     review_properties = review_page_soup.find('ul', attrs={'class' : 'reviewDetail'})
+    # 行った時期などの属性がないページもあるので、そのときはタイトルと本文だけ返す
+    if review_properties is None:
+        return review_property_dict
     review_properties = review_properties.find_all('li')
     review_properties=[review_property.text.strip() for review_property in review_properties]
 
-    # 文字化けで止まってしまうのでその対策
-    try:
-        for review_property in review_properties:
-            # 止まったら確認用に使う
-            # print('review_property', review_property)
+    for review_property in review_properties:
+        # 止まったら確認用に使う
+        # print('review_property', review_property)
+        # 文字化けで止まってしまうのでその対策（文字化けした属性だけ飛ばす）
+        try:
             column_name = review_property.split('：')[0]
             column_data = review_property.split('：')[1]
+        except IndexError as e:
+            review_property_dict['Error'] = e
+            continue
 
         review_property_dict[column_name] = column_data
 
-    except IndexError as e:
-        review_property_dict['Error'] = e
-
     return review_property_dict
 
 def get_review_img(landmark_id:int, review_id:int, review_page_soup:bs4.BeautifulSoup, img_interval:int)->list:
@@ -452,7 +651,7 @@ def get_review_img(landmark_id:int, review_id:int, review_page_soup:bs4.Beautifu
         img_url = img_elem.attrs['srcset']
         img_url = 'https:' + img_url
 
-        img = Image.open(io.BytesIO(requests.get(img_url).content))
+        img = get_img(img_url)
         img_name=str(landmark_id) + '_' + str(review_id) + '_' + str(img_id)
         img.save(f'imgs/jalan/{img_name}.jpg')
 
@@ -461,4 +660,98 @@ def get_review_img(landmark_id:int, review_id:int, review_page_soup:bs4.Beautifu
         img_id += 1
         time.sleep(img_interval)
 
-    return img_name_list
\ No newline at end of file
+    return img_name_list
+
+def to_jalan_review_record(landmark_id:int, landmark_url:str, review_property_dict:dict) -> dict:
+    """to_jalan_review_record
+        get_jalan_reviewの返り値を、JALAN_REVIEW_COLUMNSのカラムの辞書（CSVの1行）に変換する関数
+        ないカラムは空欄にする
+
+        Args:
+            landmark_id (int): 観光地の通し番号
+            landmark_url (str): 観光地のページのURL
+            review_property_dict (dict): get_jalan_reviewの返り値
+
+        Returns:
+            dict: JALAN_REVIEW_COLUMNSのカラムがKeyの辞書（例：{'観光地ID':0, '観光地URL':'', 'レビューID':0, ..., '投稿日':''}）
+    """
+    record = {}
+    for column_name, key in JALAN_REVIEW_COLUMNS.items():
+        record[column_name] = review_property_dict.get(key, '')
+
+    record["観光地ID"] = landmark_id
+    record["観光地URL"] = landmark_url
+
+    return record
+
+def iter_landmark_reviews(landmark_id:int, landmark_url:str, page_interval:int, img_interval:int, written_review_urls:Union[None, set]=None):
+    """iter_landmark_reviews
+        観光地1つ分の口コミページを次へがなくなるまでたどって、画像付きのレビューを1件ずつ返すジェネレータ
+        レビューごとに画像も取得して保存する
+
+        Args:
+            landmark_id (int): 観光地の通し番号
+            landmark_url (str): 観光地のページのURL（例：'https://www.jalan.net/kankou/spt_06201ag2130012345/'）
+            page_interval (int): 口コミページが変化するごとに設けるインターバル（秒）
+            img_interval (int): 画像が変化するごとに設けるインターバル（秒）
+            written_review_urls (set): すでにCSVに書き込んだレビューのURL。チェックポイントから再開したときに、これらのレビューは取得し直さない
+
+        Yields:
+            tuple: (get_jalan_reviewの返り値, get_review_imgの返り値)
+
+        Examples:
+
+            >>> for review_property_dict, img_name_list in iter_landmark_reviews(0, landmark_url, 60, 30):
+            ...     print(review_property_dict['review'], img_name_list)
+    """
+    # ①一つの観光地についての口コミ１ページ
+    page_url = landmark_url + 'kuchikomi'
+    review_count = 0
+
+    while True:
+        options = Options()
+        options.add_argument('--headless')
+        browser_page = webdriver.Chrome(ChromeDriverManager().install(), options=options)
+        # 上限に達したときやリクエストのエラーのときもChromeを閉じる
+        try:
+            if _scheduler is not None:
+                _scheduler.charge(page_url)
+            browser_page.get(page_url)
+
+            page_soup = BeautifulSoup(get_html(page_url, 'jalan_page'), 'html.parser')
+
+            # ①観光地のレビュー、一覧ページ
+            all_content = page_soup.find_all('div', attrs={'class' : 'item-listContents'})
+            for content in all_content:
+
+                if is_existing_img(content):
+                    # 前回書き込んだレビューは通し番号だけ進めて飛ばす
+                    if written_review_urls and get_review_page_url(content) in written_review_urls:
+                        review_count += 1
+                        continue
+
+                    # ②IMGのコメントだけを抽出
+                    review_page_soup = get_review_page_soup(content, page_url)
+                    review_property_dict = get_jalan_review(review_count, content, review_page_soup)
+
+                    # reviewが文字化けしたレビューだけ飛ばす
+                    if review_property_dict['review'] == '':
+                        logging.warning('review encoding error: {0}'.format(review_property_dict.get('Error')))
+                        continue
+
+                    img_name_list = get_review_img(landmark_id, review_count, review_page_soup, img_interval)
+
+                    yield review_property_dict, img_name_list
+
+                    review_count += 1
+
+            try:
+                browser_page.find_element_by_link_text('次へ').click()
+            except NoSuchElementException:
+                break
+
+            time.sleep(page_interval)
+            page_url = browser_page.current_url
+
+        finally:
+            browser_page.quit()
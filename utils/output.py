@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+
+from absl import logging
+
+def load_written_values(path:str, column:str) -> set:
+    """load_written_values
+
+        CSVにすでに書き込まれている、あるカラムの値をすべて読み込む関数
+        チェックポイントから再開したときに、書き込み済みのレコードを飛ばすために使う
+
+        Args:
+            path (str): CSVのパス
+            column (str): 読み込むカラム（例：'レビューURL'）
+
+        Returns:
+            set: カラムの値の集合。CSVがないときは空の集合
+    """
+    if not os.path.exists(path):
+        return set()
+
+    return set(pd.read_csv(path, usecols=[column])[column].dropna())
+
+class BatchCsvWriter:
+    """BatchCsvWriter
+
+        レコード（辞書）をためておき、batch_size件ごとにまとめて1つのCSVに追記するクラス
+        メモリにはbatch_size件までしか持たないので、都道府県全体のレビューでもメモリが増え続けない
+        カラムはcolumnsで固定し、ないカラムは空欄にする
+
+        Args:
+            path (str): 書き込むCSVのパス
+            columns (list): CSVのカラム
+            batch_size (int): まとめて書き込む件数
+
+        Examples:
+
+            >>> writer = BatchCsvWriter('csv/jalan/attribute_Yamagata.csv', ['レビューID', 'レビュー'], 100)
+            >>> writer.write({'レビューID':0, 'レビュー':'...'})
+            >>> writer.close()
+    """
+    def __init__(self, path:str, columns:list, batch_size:int=100):
+        self.path = path
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.records = []
+
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, record:dict) -> None:
+        self.records.append(record)
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.records:
+            return
+
+        # 既存のCSVがあるときは追記して、ヘッダは最初の1回だけ書く
+        df = pd.DataFrame.from_records(self.records, columns=self.columns)
+        df.to_csv(self.path, mode='a', header=not os.path.exists(self.path), index=False)
+        logging.info('wrote {0} records to {1}'.format(len(self.records), self.path))
+
+        self.records = []
+
+    def close(self) -> None:
+        self.flush()
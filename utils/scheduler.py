@@ -0,0 +1,232 @@
+from typing import Union
+from urllib.parse import urlparse
+import hashlib
+import heapq
+import json
+import os
+import time
+
+from absl import logging
+
+# 数字が小さいほど先に取得する
+PRIORITY_NEW = 0      # 前回のクロールで見ていない物件
+PRIORITY_CHANGED = 1  # 一覧ページの内容（価格など）が前回から変わった物件
+PRIORITY_UNCHANGED = 2  # 一覧ページの内容が前回から変わっていない物件
+PRIORITY_IMAGE = 3    # 画像（テキストのページをすべて取得してから取得する）
+
+class BudgetExhausted(Exception):
+    """実行時間、リクエスト数、ホストごとのリクエスト数のいずれかの上限に達したときに送出される例外"""
+
+def parse_host_budgets(host_budgets:list) -> dict:
+    """parse_host_budgets
+
+        'ホスト名:リクエスト数'のリストをホストごとの上限の辞書にする関数
+
+        Args:
+            host_budgets (list): ホストごとの上限のリスト（例：['suumo.jp:500', 'jalan.net:300']）
+
+        Returns:
+            dict: ホスト名がKey、リクエスト数の上限がValueの辞書（例：{'suumo.jp':500, 'jalan.net':300}）
+
+        Raises:
+            ValueError: 'ホスト名:リクエスト数'の形式になっていないとき
+    """
+    budgets = {}
+    for host_budget in host_budgets or []:
+        host, budget = host_budget.rsplit(':', 1)
+        budgets[host] = int(budget)
+
+    return budgets
+
+def fingerprint(text:str) -> str:
+    """fingerprint
+
+        一覧ページの物件の表示内容から、変更を検出するためのハッシュを作る関数
+
+        Args:
+            text (str): 一覧ページに表示されている物件の内容
+
+        Returns:
+            str: md5のハッシュ値
+    """
+    return hashlib.md5(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+class Scheduler:
+    """Scheduler
+
+        実行時間、リクエスト数、ホストごとのリクエスト数の上限を管理しながら、優先度の高い順に取得するページを返すクラス
+        上限に達したら、残りの取得予定と物件ごとのハッシュをチェックポイントに保存して、次回はそこから再開する
+
+        Args:
+            max_runtime (int): 実行時間の上限（秒）。0のときは無制限
+            max_requests (int): リクエスト数の上限。0のときは無制限
+            host_budgets (dict): ホストごとのリクエスト数の上限（parse_host_budgetsの返り値）
+            checkpoint_path (str): チェックポイントのファイルのパス
+
+        Examples:
+
+            >>> scheduler = Scheduler(max_runtime=3600, max_requests=2000, host_budgets={'suumo.jp':1500}, checkpoint_path='checkpoint/suumo_Yamagata.json')
+            >>> scheduler.push(PRIORITY_NEW, {'type':'listing', 'url':url})
+            >>> priority, task = scheduler.pop()
+    """
+    def __init__(self, max_runtime:int=0, max_requests:int=0, host_budgets:Union[None, dict]=None, checkpoint_path:Union[None, str]=None):
+        self.max_runtime = max_runtime
+        self.max_requests = max_requests
+        self.host_budgets = host_budgets or {}
+        self.checkpoint_path = checkpoint_path
+
+        self.started_at = time.monotonic()
+        self.request_count = 0
+        self.host_counts = {}
+
+        self.queue = []
+        self.queue_count = 0
+        self.queued_urls = set()
+        self.fingerprints = {}
+        # 次回再開する一覧ページのURLと、通し番号などの呼び出し側の状態。チェックポイントに一緒に保存する
+        self.next_index_url = None
+        self.state = {}
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+    def _host_budget_key(self, host:str) -> Union[None, str]:
+        # 'suumo.jp'の上限は'img01.suumo.jp'のようなサブドメインにも適用する
+        for key in self.host_budgets:
+            if host == key or host.endswith('.' + key):
+                return key
+        return None
+
+    def exhausted_reason(self, url:Union[None, str]=None) -> Union[None, str]:
+        """exhausted_reason
+
+            上限に達しているかを確認する関数
+
+            Args:
+                url (str): これから取得するURL。指定したときはホストごとの上限も確認する
+
+            Returns:
+                str: 上限に達している場合はその理由、達していない場合はNone
+        """
+        if self.max_runtime and time.monotonic() - self.started_at >= self.max_runtime:
+            return 'max_runtime'
+        if self.max_requests and self.request_count >= self.max_requests:
+            return 'max_requests'
+        if url is not None:
+            key = self._host_budget_key(urlparse(url).hostname or '')
+            if key is not None and self.host_counts.get(key, 0) >= self.host_budgets[key]:
+                return 'host budget ' + key
+
+        return None
+
+    def charge(self, url:str) -> None:
+        """charge
+
+            リクエストを1回分数える関数。リクエストを送る直前に呼ぶ
+
+            Args:
+                url (str): これから取得するURL
+
+            Raises:
+                BudgetExhausted: いずれかの上限に達しているとき
+        """
+        reason = self.exhausted_reason(url)
+        if reason is not None:
+            raise BudgetExhausted(reason)
+
+        self.request_count += 1
+        key = self._host_budget_key(urlparse(url).hostname or '')
+        if key is not None:
+            self.host_counts[key] = self.host_counts.get(key, 0) + 1
+
+    def listing_priority(self, url:str, listing_fingerprint:str) -> int:
+        """listing_priority
+
+            一覧ページの物件の優先度を決める関数
+
+            Args:
+                url (str): 物件ページのURL
+                listing_fingerprint (str): 一覧ページの物件の表示内容のハッシュ（fingerprintの返り値）
+
+            Returns:
+                int: 前回見ていない物件はPRIORITY_NEW、内容が変わった物件はPRIORITY_CHANGED、変わっていない物件はPRIORITY_UNCHANGED
+        """
+        if url not in self.fingerprints:
+            return PRIORITY_NEW
+        if self.fingerprints[url] != listing_fingerprint:
+            return PRIORITY_CHANGED
+        return PRIORITY_UNCHANGED
+
+    def mark_done(self, url:str, listing_fingerprint:str) -> None:
+        self.fingerprints[url] = listing_fingerprint
+
+    def push(self, priority:int, task:dict) -> None:
+        """push
+
+            取得予定に追加する関数
+            同じURLがすでに取得予定にある場合は追加しない（チェックポイントから再開して一覧ページを見直したときなど）
+
+            Args:
+                priority (int): PRIORITY_NEWなどの優先度
+                task (dict): 取得予定の辞書。チェックポイントに保存するのでJSONにできる値だけを入れる（例：{'type':'listing', 'url':url}）
+        """
+        if task['url'] in self.queued_urls:
+            return
+
+        # 同じ優先度の中では追加した順に取り出す
+        heapq.heappush(self.queue, (priority, self.queue_count, task))
+        self.queue_count += 1
+        self.queued_urls.add(task['url'])
+
+    def pop(self) -> Union[None, tuple]:
+        """pop
+
+            優先度が一番高い取得予定を取り出す関数
+
+            Returns:
+                tuple: (優先度, 取得予定の辞書)。取得予定がないときはNone
+        """
+        if not self.queue:
+            return None
+
+        priority, _, task = heapq.heappop(self.queue)
+        self.queued_urls.discard(task['url'])
+
+        return priority, task
+
+    def load_checkpoint(self) -> None:
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+
+        self.fingerprints = checkpoint['fingerprints']
+        self.next_index_url = checkpoint['next_index_url']
+        self.state = checkpoint['state']
+        for priority, task in checkpoint['pending']:
+            self.push(priority, task)
+
+        logging.info('loaded checkpoint %s: %d pending tasks', self.checkpoint_path, len(self.queue))
+
+    def save_checkpoint(self) -> None:
+        """save_checkpoint
+
+            残りの取得予定、物件ごとのハッシュ、次に見る一覧ページのURLをチェックポイントに保存する関数
+        """
+        if not self.checkpoint_path:
+            return
+
+        checkpoint_dir = os.path.dirname(self.checkpoint_path)
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+        checkpoint = {
+            'fingerprints' : self.fingerprints,
+            'next_index_url' : self.next_index_url,
+            'state' : self.state,
+            'pending' : [[priority, task] for priority, _, task in sorted(self.queue)],
+        }
+        # 書き込み途中で止まってもチェックポイントが壊れないように、一時ファイルに書いてから置き換える
+        with open(self.checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+        logging.info('saved checkpoint %s: %d pending tasks, %d requests', self.checkpoint_path, len(self.queue), self.request_count)
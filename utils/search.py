@@ -0,0 +1,203 @@
+from typing import Union
+import os
+import re
+import sqlite3
+
+# 日本語は単語の区切りがないので、本文を2文字ずつ（bi-gram）に区切った文字列をFTS5に登録する
+# FTS5のtrigramトークナイザだと「紅葉」「温泉」のような2文字以下の語を検索できないため
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY,
+    landmark_id INTEGER,
+    landmark_url TEXT,
+    review_id INTEGER,
+    review_url TEXT UNIQUE,
+    title TEXT,
+    review TEXT,
+    visited TEXT,
+    crowding TEXT,
+    stay TEXT,
+    posted TEXT,
+    posted_date TEXT
+);
+CREATE INDEX IF NOT EXISTS reviews_landmark_id ON reviews(landmark_id);
+CREATE INDEX IF NOT EXISTS reviews_landmark_url ON reviews(landmark_url);
+CREATE INDEX IF NOT EXISTS reviews_posted_date ON reviews(posted_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+    title, review, content='', tokenize='unicode61'
+);
+"""
+
+def open_index(index_path:str) -> sqlite3.Connection:
+    """open_index
+
+        レビューの検索インデックス（SQLite）を開く関数。なければ作成する
+
+        Args:
+            index_path (str): インデックスのファイルのパス（例：'csv/jalan/reviews.db'）
+
+        Returns:
+            sqlite3.Connection: インデックスのコネクション
+    """
+    index_dir = os.path.dirname(index_path)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+
+    conn = sqlite3.connect(index_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+
+    return conn
+
+def to_bigrams(text:str) -> str:
+    """to_bigrams
+
+        文字列を1文字ずつずらした2文字ごとに空白で区切る関数
+        最後の1文字も1文字だけのトークンとして残すので、1文字の語も前方一致で検索できる
+
+        Args:
+            text (str): レビューのタイトルや本文
+
+        Returns:
+            str: 空白区切りのbi-gram
+
+        Examples:
+
+            >>> to_bigrams('紅葉狩り')
+                '紅葉 葉狩 狩り り'
+    """
+    text = ''.join(text.split())
+    return ' '.join(text[i:i + 2] for i in range(len(text)))
+
+def to_match_phrase(term:str) -> str:
+    """to_match_phrase
+
+        検索語をFTS5のMATCHで使うフレーズに変換する関数
+        bi-gramを並べたフレーズにすることで、隣り合っているものだけが一致する
+
+        Args:
+            term (str): 検索語
+
+        Returns:
+            str: MATCHのフレーズ（例：'"紅葉 葉狩 狩り"'、1文字のときは'"雪"*'）
+    """
+    term = term.replace('"', '""')
+    if len(term) == 1:
+        return '"' + term + '"*'
+
+    return '"' + ' '.join(term[i:i + 2] for i in range(len(term) - 1)) + '"'
+
+def to_iso_date(text:str) -> Union[None, str]:
+    """to_iso_date
+
+        じゃらんの「投稿日」（例：'2022/06/01'）をYYYY-MM-DDの形式に変換する関数
+        期間で絞り込むときに文字列のまま大小比較できるようにするために使う
+
+        Args:
+            text (str): 投稿日の文字列
+
+        Returns:
+            str: YYYY-MM-DD形式の日付。日付が読み取れなかったときはNone
+
+        Examples:
+
+            >>> to_iso_date('2022/6/1')
+                '2022-06-01'
+    """
+    match = re.search(r'(\d{4})\D+(\d{1,2})\D+(\d{1,2})', text or '')
+    if match is None:
+        return None
+
+    year, month, day = match.groups()
+    return '{0}-{1:02d}-{2:02d}'.format(year, int(month), int(day))
+
+def add_review(conn:sqlite3.Connection, landmark_id:int, landmark_url:str, review_property_dict:dict) -> bool:
+    """add_review
+
+        レビュー1件をインデックスに追加する関数
+        同じレビューURLがすでに登録されているときは何もしない
+        コミットは呼び出し側でまとめて行う
+
+        Args:
+            conn (sqlite3.Connection): open_indexの返り値
+            landmark_id (int): 観光地の通し番号（クロールごとの番号なので、観光地を絞り込むときはlandmark_urlを使う）
+            landmark_url (str): 観光地のページのURL
+            review_property_dict (dict): レビューの情報が入った辞書（get_jalan_reviewの返り値を想定）
+
+        Returns:
+            bool: 新しく追加されたときはTrue
+    """
+    posted = review_property_dict.get('投稿日', '')
+    cursor = conn.execute(
+        'INSERT OR IGNORE INTO reviews (landmark_id, landmark_url, review_id, review_url, title, review, visited, crowding, stay, posted, posted_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (landmark_id, landmark_url, review_property_dict['review_id'], review_property_dict['review_page_url'],
+         review_property_dict.get('title', ''), review_property_dict.get('review', ''),
+         review_property_dict.get('行った時期', ''), review_property_dict.get('混雑具合', ''),
+         review_property_dict.get('滞在時間', ''), posted, to_iso_date(posted)))
+
+    if cursor.rowcount == 0:
+        return False
+
+    conn.execute('INSERT INTO reviews_fts (rowid, title, review) VALUES (?, ?, ?)',
+        (cursor.lastrowid, to_bigrams(review_property_dict.get('title', '')), to_bigrams(review_property_dict.get('review', ''))))
+
+    return True
+
+def search(conn:sqlite3.Connection, query:str='', landmark_id:Union[None, int]=None, landmark_url:Union[None, str]=None, since:Union[None, str]=None, until:Union[None, str]=None, crowding:Union[None, str]=None, limit:int=20) -> list:
+    """search
+
+        インデックスからレビューを検索する関数
+        queryは空白区切りの語をすべて含むレビュー（タイトルか本文）を検索する
+
+        Args:
+            conn (sqlite3.Connection): open_indexの返り値
+            query (str): 検索語（例：'紅葉 駐車場'）
+            landmark_id (int): 観光地の通し番号で絞り込む。通し番号はクロールごとに振り直され、同じレビューは最初に登録したときの番号のままなので、クロールをまたいで同じ観光地を指すとは限らない
+            landmark_url (str): 観光地のページのURLで絞り込む（例：'https://www.jalan.net/kankou/spt_06201ag2130012345/'）
+            since (str): この日以降（YYYY-MM-DD）の投稿日で絞り込む
+            until (str): この日以前（YYYY-MM-DD）の投稿日で絞り込む
+            crowding (str): 混雑具合（例：'混雑していた'）で絞り込む
+            limit (int): 返す件数の上限
+
+        Returns:
+            list: 該当するレビューの辞書のリスト
+
+        Examples:
+
+            >>> search(conn, '紅葉', since='2021-10-01', crowding='混雑していた')
+                [{'landmark_id': 3, 'review_url': 'https://...', 'title': '...', 'review': '...', ...}, ...]
+    """
+    match_terms = [to_match_phrase(term) for term in query.split()]
+    conditions = []
+    params = []
+
+    if landmark_id is not None:
+        conditions.append('reviews.landmark_id = ?')
+        params.append(landmark_id)
+    if landmark_url:
+        conditions.append('reviews.landmark_url = ?')
+        params.append(landmark_url)
+    if since:
+        conditions.append('reviews.posted_date >= ?')
+        params.append(since)
+    if until:
+        conditions.append('reviews.posted_date <= ?')
+        params.append(until)
+    if crowding:
+        conditions.append('reviews.crowding = ?')
+        params.append(crowding)
+
+    if match_terms:
+        sql = 'SELECT reviews.* FROM reviews_fts JOIN reviews ON reviews.id = reviews_fts.rowid WHERE reviews_fts MATCH ?'
+        params.insert(0, ' AND '.join(match_terms))
+        order = 'reviews_fts.rank'
+    else:
+        sql = 'SELECT reviews.* FROM reviews WHERE 1'
+        order = 'reviews.posted_date DESC'
+
+    for condition in conditions:
+        sql += ' AND ' + condition
+    sql += ' ORDER BY ' + order + ' LIMIT ?'
+    params.append(limit)
+
+    return [dict(row) for row in conn.execute(sql, params)]